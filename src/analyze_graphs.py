@@ -1,10 +1,13 @@
+import sys
+import csv
 import itertools
 import networkx as nx
+import numpy as np
 import random
 from networkx.algorithms.community.modularity_max import greedy_modularity_communities
 from networkx.algorithms import centrality
 from networkx.algorithms.community.centrality import girvan_newman
-from utils import create_topic_map, get_literal_topics
+from utils import create_topic_map, get_literal_topics, load_graph, save_communities
 
 """
 Analyze user-user graphs with community detection and more
@@ -174,7 +177,7 @@ def sample_topics(topic_scores, take_top=True, n=5):
     return topics.tolist()
 
 
-def compute_betweenness_graph(user_user_graph, communities, k=500):
+def compute_betweenness_graph(user_user_graph, communities, k=500, prototypes=None):
     """
     Computes the shortest-path betweenness centrality for each node. To
     improve runtime, a sample of k nodes from the graph are used. To best
@@ -186,6 +189,8 @@ def compute_betweenness_graph(user_user_graph, communities, k=500):
             other users
         communities (list): List of lists containing nodes for each community
         k (int): Number of nodes to use as source and start
+        prototypes (list): Prototype of each community. If None, prototypes
+            are found with community_prototypes
 
     Returns:
         node_betweenness (dict): Dictionary of nodes with betweenness centrality as the value
@@ -195,8 +200,9 @@ def compute_betweenness_graph(user_user_graph, communities, k=500):
     print("Samples per community: {}".format(samples_per_community))
     st_nodes = set()
     # Find prototype of each community
-    for community in communities:
-        prototype = determine_prototype(user_user_graph, community)
+    if prototypes is None:
+        prototypes = community_prototypes(user_user_graph, communities)
+    for community, prototype in zip(communities, prototypes):
         if prototype is not None:
             st_nodes.add(prototype)
         # Randomly sample about same number of nodes from each community
@@ -260,3 +266,177 @@ def determine_prototype(user_user_graph, community):
             prototype = nid
 
     return prototype
+
+
+def community_prototypes(user_user_graph, communities):
+    """
+    Determines the prototype of every community (see determine_prototype) in
+    a single pass over the user-user edges, instead of one pass per community.
+
+    Arguments:
+        user_user_graph (nx.Graph): User-user graph to link users to
+            other users
+        communities (list): List of lists of nodes, one per community
+
+    Returns:
+        prototypes (list): ID of the prototype of each community, or None if
+            the community has no internal edges
+    """
+    # Label each node with the index of its community
+    labels = dict()
+    for i, community in enumerate(communities):
+        for node in community:
+            labels[node] = i
+
+    # In-community degree of each node
+    in_community_degrees = dict()
+    for u, v in user_user_graph.edges():
+        if u != v and u in labels and labels.get(v) == labels[u]:
+            in_community_degrees[u] = in_community_degrees.get(u, 0) + 1
+            in_community_degrees[v] = in_community_degrees.get(v, 0) + 1
+
+    # Prototype is the first node with the largest in-community degree
+    prototypes = []
+    for community in communities:
+        max_edges = 0
+        prototype = None
+        for node in community:
+            if in_community_degrees.get(node, 0) > max_edges:
+                max_edges = in_community_degrees[node]
+                prototype = node
+        prototypes.append(prototype)
+    return prototypes
+
+
+# Columns of the table returned by community_report
+REPORT_COLUMNS = ['community', 'size', 'mean_betweenness', 'prototype',
+                  'top_topics', 'top_topic_ratios', 'top_topic_literals']
+
+
+def community_report(user_user_graph, user_topic_graph, communities,
+                     node_betweenness=None, topic_map=None, n=20, ratio_thresh=0.,
+                     prototypes=None):
+    """
+    Analyzes all communities of a partition at once, instead of walking the
+    graphs once per community with compute_community_betweenness,
+    extract_topics_from_community and determine_prototype. Each graph is
+    walked once: user-user edges give the prototypes (see
+    community_prototypes) and user-topic edges give the topic counts of every
+    community.
+
+    Arguments:
+        user_user_graph (nx.Graph): User-user graph to link users to
+            other users
+        user_topic_graph (nx.Graph): User-topic graph to link users to
+            their topics
+        communities (list): List of lists of nodes, one per community
+        node_betweenness (dict): Dictionary of nodes with betweenness
+            centrality as the value. If None, mean_betweenness is left empty
+        topic_map (dict): Mapping from topic node id to topic literals. If
+            None, top_topic_literals is left empty
+        n (int): Number of top topics to report per community
+        ratio_thresh (float): Ratio of users that a topic must be linked to,
+            to be reported
+        prototypes (list): Prototype of each community, e.g. as already
+            computed for compute_betweenness_graph. If None, prototypes are
+            found with community_prototypes
+
+    Returns:
+        report (dict): Map from column name (see REPORT_COLUMNS) -> list with
+            one value per community
+    """
+    num_communities = len(communities)
+    # Label each node with the index of its community
+    labels = dict()
+    for i, community in enumerate(communities):
+        for node in community:
+            labels[node] = i
+    sizes = np.array([len(community) for community in communities], dtype=float)
+
+    # Mean betweenness of each community
+    mean_betweenness = [None] * num_communities
+    if node_betweenness is not None:
+        nodes = list(labels)
+        node_labels = np.array([labels[node] for node in nodes], dtype=int)
+        betweenness = np.array([node_betweenness[node] for node in nodes], dtype=float)
+        sums = np.bincount(node_labels, weights=betweenness, minlength=num_communities)
+        mean_betweenness = (sums / np.maximum(sizes, 1)).tolist()
+
+    # Prototypes, in one pass over the user-user edges
+    if prototypes is None:
+        prototypes = community_prototypes(user_user_graph, communities)
+
+    # Topic counts of each community, in one pass over the user-topic edges
+    topic_counts = [dict() for _ in communities]  # Map of topic id -> num members linked to it
+    for u, v in user_topic_graph.edges():
+        # User nodes are those with positive ids!
+        user, topic = (u, v) if u > 0 else (v, u)
+        if user in labels:
+            counts = topic_counts[labels[user]]
+            counts[topic] = counts.get(topic, 0) + 1
+
+    top_topics = []
+    top_topic_ratios = []
+    top_topic_literals = []
+    for i, counts in enumerate(topic_counts):
+        ratios = [(topic, count / sizes[i]) for topic, count in counts.items()
+                  if count / sizes[i] > ratio_thresh]
+        ratios.sort(key=lambda tr: tr[1], reverse=True)
+        ratios = ratios[:n]
+        top_topics.append([topic for topic, _ in ratios])
+        top_topic_ratios.append([ratio for _, ratio in ratios])
+        if topic_map is None:
+            top_topic_literals.append(None)
+        else:
+            top_topic_literals.append(get_literal_topics(top_topics[-1], topic_map))
+
+    return {'community': list(range(num_communities)),
+            'size': sizes.astype(int).tolist(),
+            'mean_betweenness': mean_betweenness,
+            'prototype': prototypes,
+            'top_topics': top_topics,
+            'top_topic_ratios': top_topic_ratios,
+            'top_topic_literals': top_topic_literals}
+
+
+def write_community_report(report, report_path):
+    """
+    Writes a community report to csv, or to parquet if report_path ends with
+    '.parquet' (requires pyarrow). In csv, list columns are written as '|'
+    separated values.
+
+    Arguments:
+        report (dict): Map from column name -> list, as returned by
+            community_report
+        report_path (str): Path of file to write report to
+    """
+    if report_path.endswith('.parquet'):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Writing parquet reports requires the pyarrow package")
+        pq.write_table(pa.table(report), report_path)
+        return
+
+    with open(report_path, 'w', newline='') as report_f:
+        wr = csv.writer(report_f)
+        wr.writerow(REPORT_COLUMNS)
+        for row in zip(*[report[column] for column in REPORT_COLUMNS]):
+            wr.writerow(['|'.join(map(lambda v: str(v).strip(), value)) if isinstance(value, list) else value
+                         for value in row])
+
+
+def main(user_user_graph_path, communities_path, community_size_thresh=2):
+    user_user_graph = load_graph(user_user_graph_path)
+    # Compute modularity-maximizing communities, dropping very small ones
+    communities = modularity_communities(user_user_graph)
+    communities = list(filter(lambda c: len(c) > community_size_thresh, communities))
+    print("{} communities".format(len(communities)))
+    save_communities(communities, communities_path)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        raise Exception("usage: python analyze_graphs.py <user_user_graph>.txt <communities>.txt")
+    main(sys.argv[1], sys.argv[2])
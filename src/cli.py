@@ -0,0 +1,179 @@
+import argparse
+
+"""
+Single entry point for the pipeline:
+
+    python cli.py ingest | preprocess | extract | build-graph | detect | report | track ...
+
+Each subcommand only imports the modules it needs, when it runs.
+"""
+
+
+def run_ingest(args):
+    import load_data
+    load_data.main(args.sources, args.database, args.table,
+                   columns=args.columns, headers=args.headers,
+                   num_workers=args.workers)
+
+
+def run_preprocess(args):
+    import preprocess
+    preprocess.main(args.source, args.output)
+
+
+def run_extract(args):
+    import topic_model
+    topic_model.main(args.database, args.author_output, args.topic_output,
+                     args.topic_freq_output, args.author_topic_output,
+                     args.lexicon_sample, args.monthly, args.weighted_edges)
+
+
+def run_build_graph(args):
+    import graph_model
+    graph_model.main(args.user_topic_graph, args.topic_freqs, args.output,
+                     n=args.top_n, threshold=args.threshold, knn=args.knn,
+                     similarity=args.similarity, mutual=args.mutual,
+                     weighted=args.weighted)
+
+
+def run_detect(args):
+    import analyze_graphs
+    analyze_graphs.main(args.user_user_graph, args.output, args.min_size)
+
+
+def run_report(args):
+    import analyze_graphs
+    from utils import load_graph, load_communities, create_topic_map
+    user_user_graph = load_graph(args.user_user_graph)
+    user_topic_graph = load_graph(args.user_topic_graph)
+    communities = load_communities(args.communities)
+    # Prototypes are found once and used for both betweenness and the report
+    prototypes = analyze_graphs.community_prototypes(user_user_graph, communities)
+    node_betweenness = analyze_graphs.compute_betweenness_graph(user_user_graph, communities,
+                                                                k=args.betweenness_k,
+                                                                prototypes=prototypes)
+    topic_map = create_topic_map(args.topics) if args.topics else None
+    report = analyze_graphs.community_report(user_user_graph, user_topic_graph, communities,
+                                             node_betweenness, topic_map, n=args.top_n,
+                                             prototypes=prototypes)
+    analyze_graphs.write_community_report(report, args.output)
+
+
+def run_track(args):
+    import community_model
+    community_model.main(args.user_topic_edges, args.topic_freqs, args.output,
+                         args.events_output, window_size=args.window_size,
+                         step=args.step, n=args.top_n, threshold=args.threshold,
+                         knn=args.knn)
+
+
+def create_parser():
+    """
+    Creates the argument parser with one subparser per pipeline stage.
+
+    Returns:
+        parser (argparse.ArgumentParser): Parser for the pipeline CLI
+    """
+    parser = argparse.ArgumentParser(description="Reddit community detection pipeline")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    ingest_parser = subparsers.add_parser('ingest', help="Load tsv dumps into sqlite")
+    ingest_parser.add_argument('sources', nargs='+',
+                               help="Source tsv files (optionally .bz2, .xz, .gz or .zst)")
+    ingest_parser.add_argument('database', help="Sqlite database to load into")
+    ingest_parser.add_argument('table', help="Table to create")
+    ingest_parser.add_argument('--columns', nargs='+', default=None,
+                               help="Columns to keep (default: author_name time_stamp text)")
+    ingest_parser.add_argument('--headers', nargs='+', default=None,
+                               help="Columns the files contain, in order (default: full dump headers)")
+    ingest_parser.add_argument('--workers', type=int, default=None,
+                               help="Number of parser processes (default: one per cpu)")
+    ingest_parser.set_defaults(func=run_ingest)
+
+    preprocess_parser = subparsers.add_parser('preprocess', help="Clean comment text")
+    preprocess_parser.add_argument('source', help="Source tsv file")
+    preprocess_parser.add_argument('output', help="Where to write cleaned tsv")
+    preprocess_parser.set_defaults(func=run_preprocess)
+
+    extract_parser = subparsers.add_parser('extract', help="Extract author topics")
+    extract_parser.add_argument('database', help="Sqlite database of comments")
+    extract_parser.add_argument('author_output', help="Where to write author ids")
+    extract_parser.add_argument('topic_output', help="Where to write topic ids")
+    extract_parser.add_argument('topic_freq_output', help="Where to write topic frequencies")
+    extract_parser.add_argument('author_topic_output',
+                                help="Where to write author-topic edges (binary if it ends with .bin)")
+    extract_parser.add_argument('--lexicon-sample', type=int, default=None,
+                                help="Number of comments to build a pos lexicon from")
+    extract_parser.add_argument('--monthly', action='store_true',
+                                help="Write author-topic edges per month, for track")
+    extract_parser.add_argument('--weighted-edges', action='store_true',
+                                help="Weight author-topic edges by number of comments")
+    extract_parser.set_defaults(func=run_extract)
+
+    graph_parser = subparsers.add_parser('build-graph', help="Build the user-user graph")
+    graph_parser.add_argument('user_topic_graph', help="User-topic edge list")
+    graph_parser.add_argument('topic_freqs', help="Topic frequencies")
+    graph_parser.add_argument('output', help="Where to write user-user edge list")
+    graph_parser.add_argument('--top-n', type=int, default=20,
+                              help="Number of most frequent topics to keep")
+    graph_parser.add_argument('--threshold', type=float, default=0.35,
+                              help="IOU above which users are connected")
+    graph_parser.add_argument('--knn', type=int, default=None,
+                              help="Connect each user to its k most similar users instead")
+    graph_parser.add_argument('--similarity', choices=['iou', 'jaccard', 'weighted_jaccard'],
+                              default='iou',
+                              help="Similarity used with --knn")
+    graph_parser.add_argument('--mutual', action='store_true',
+                              help="With --knn, only connect mutual nearest neighbors")
+    graph_parser.add_argument('--weighted', action='store_true',
+                              help="With --knn, weight edges by similarity")
+    graph_parser.set_defaults(func=run_build_graph)
+
+    detect_parser = subparsers.add_parser('detect', help="Detect communities")
+    detect_parser.add_argument('user_user_graph', help="User-user edge list")
+    detect_parser.add_argument('output', help="Where to write communities")
+    detect_parser.add_argument('--min-size', type=int, default=2,
+                               help="Communities of this size or smaller are dropped")
+    detect_parser.set_defaults(func=run_detect)
+
+    report_parser = subparsers.add_parser('report', help="Summarize detected communities")
+    report_parser.add_argument('user_user_graph', help="User-user edge list")
+    report_parser.add_argument('user_topic_graph', help="User-topic edge list")
+    report_parser.add_argument('communities', help="Communities written by detect")
+    report_parser.add_argument('output', help="Where to write the report (.csv or .parquet)")
+    report_parser.add_argument('--topics', default=None,
+                               help="Topic literal to topic id tsv, to report topic names")
+    report_parser.add_argument('--top-n', type=int, default=20,
+                               help="Number of top topics to report per community")
+    report_parser.add_argument('--betweenness-k', type=int, default=500,
+                               help="Number of nodes sampled for betweenness")
+    report_parser.set_defaults(func=run_report)
+
+    track_parser = subparsers.add_parser('track', help="Track communities over time windows")
+    track_parser.add_argument('user_topic_edges', help="Monthly user-topic edges (extract --monthly)")
+    track_parser.add_argument('topic_freqs', help="Topic frequencies")
+    track_parser.add_argument('output', help="Where to write communities per window")
+    track_parser.add_argument('events_output', help="Where to write community events")
+    track_parser.add_argument('--window-size', type=int, default=3,
+                              help="Number of months per window")
+    track_parser.add_argument('--step', type=int, default=1,
+                              help="Number of months between windows")
+    track_parser.add_argument('--top-n', type=int, default=20,
+                              help="Number of most frequent topics to keep")
+    track_parser.add_argument('--threshold', type=float, default=0.35,
+                              help="IOU above which users are connected")
+    track_parser.add_argument('--knn', type=int, default=None,
+                              help="Connect each user to its k most similar users instead")
+    track_parser.set_defaults(func=run_track)
+
+    return parser
+
+
+def main(argv=None):
+    args = create_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+import sys
+import networkx as nx
+from analyze_graphs import modularity_communities
+from graph_model import (load_bucketed_edges, create_windowed_user_topic_graphs,
+                         load_topic_frequencies, keep_top_n_topics,
+                         create_user_user_graph, create_user_user_knn_graph,
+                         connect_on_IOU)
+
+"""
+Track how communities evolve over time windows
+"""
+
+def warm_start_communities(G, initial_communities, max_passes=10):
+    """
+    Finds communities that maximize modularity, starting from an initial
+    partition (such as the communities of the previous time window) instead of
+    from scratch. Nodes are moved to the neighboring community with the best
+    modularity gain and adjacent communities are merged while this increases
+    modularity. When the initial partition is close to the final one, only a
+    few passes over the nodes are needed.
+
+    Arguments:
+        G (networkx.Graph): Graph for which communities will be found. Edge
+            'weight's are used if present
+        initial_communities (list): List of lists of nodes to start from.
+            Nodes not in G are ignored, and nodes of G not in any community
+            start in a community of their own
+        max_passes (int): Maximum number of passes over all nodes
+
+    Returns:
+        communities (list): List of lists of nodes, where each list of nodes
+            represents a community, largest first
+    """
+    # Map each node to its community label
+    labels = dict()
+    for label, community in enumerate(initial_communities):
+        for node in community:
+            if node in G:
+                labels[node] = label
+    next_label = len(initial_communities)
+    for node in G:
+        if node not in labels:
+            labels[node] = next_label
+            next_label += 1
+
+    total_weight = G.size(weight='weight')
+    if total_weight > 0:
+        degrees = dict(G.degree(weight='weight'))
+        community_degrees = dict()  # Map from label -> sum of member degrees
+        for node, label in labels.items():
+            community_degrees[label] = community_degrees.get(label, 0.) + degrees[node]
+        for _ in range(max_passes):
+            moved = _move_nodes(G, labels, degrees, community_degrees, total_weight)
+            merged = _merge_communities(G, labels, community_degrees, total_weight)
+            if not moved and not merged:
+                break
+
+    # Group nodes by label, splitting communities that are not connected
+    grouped = dict()
+    for node, label in labels.items():
+        if label not in grouped:
+            grouped[label] = []
+        grouped[label].append(node)
+    communities = []
+    for community in grouped.values():
+        for component in nx.connected_components(G.subgraph(community)):
+            communities.append(list(component))
+    communities.sort(key=len, reverse=True)
+    return communities
+
+
+def _move_nodes(G, labels, degrees, community_degrees, total_weight):
+    """
+    One pass of moving each node to the neighboring community with the largest
+    modularity gain. Updates labels and community_degrees in place.
+
+    Returns:
+        moved (int): Number of nodes that changed community
+    """
+    moved = 0
+    for node in G:
+        current = labels[node]
+        node_degree = degrees[node]
+        # Weight of edges from node to each neighboring community
+        community_links = dict()
+        for neighbor, data in G[node].items():
+            if neighbor == node:
+                continue
+            label = labels[neighbor]
+            community_links[label] = community_links.get(label, 0.) + data.get('weight', 1)
+
+        # Gain of joining a community, up to terms shared by all communities
+        community_degrees[current] -= node_degree
+        best = current
+        best_gain = community_links.get(current, 0.) - community_degrees[current] * node_degree / (2. * total_weight)
+        for label, links in community_links.items():
+            gain = links - community_degrees[label] * node_degree / (2. * total_weight)
+            if gain > best_gain:
+                best, best_gain = label, gain
+        community_degrees[best] += node_degree
+        if best != current:
+            labels[node] = best
+            moved += 1
+    return moved
+
+
+def _merge_communities(G, labels, community_degrees, total_weight):
+    """
+    Merges pairs of adjacent communities while this increases modularity, each
+    community merging at most once per call. Updates labels and
+    community_degrees in place.
+
+    Returns:
+        merged (int): Number of merges
+    """
+    # Weight of edges between each pair of communities
+    between_weights = dict()
+    for u, v, data in G.edges(data=True):
+        label_u, label_v = labels[u], labels[v]
+        if label_u == label_v:
+            continue
+        pair = (min(label_u, label_v), max(label_u, label_v))
+        between_weights[pair] = between_weights.get(pair, 0.) + data.get('weight', 1)
+
+    gains = []
+    for (label_a, label_b), weight in between_weights.items():
+        gain = weight - community_degrees[label_a] * community_degrees[label_b] / (2. * total_weight)
+        if gain > 0:
+            gains.append((gain, label_a, label_b))
+    gains.sort(reverse=True)
+
+    merge_into = dict()  # Map from merged label -> label it was merged into
+    for _, label_a, label_b in gains:
+        if label_a in merge_into or label_b in merge_into:
+            continue
+        merge_into[label_b] = label_a
+        merge_into[label_a] = label_a
+        community_degrees[label_a] += community_degrees.pop(label_b)
+
+    merged = 0
+    for label, target in merge_into.items():
+        merged += label != target
+    if merged:
+        for node, label in labels.items():
+            labels[node] = merge_into.get(label, label)
+    return merged
+
+
+def match_communities(previous_communities, communities, min_overlap=0.3):
+    """
+    Matches the communities of two consecutive time windows. A previous
+    community and a community are linked if their shared nodes make up at
+    least min_overlap of both. Events are then:
+        ('continue', i, j): previous community i is only linked to j and vice versa
+        ('split', i, (j, ...)): previous community i is linked to several communities
+        ('merge', (i, ...), j): several previous communities are linked to j
+        ('dissolve', i, None): previous community i is not linked to any community
+        ('form', None, j): community j is not linked to any previous community
+
+    Arguments:
+        previous_communities (list): List of lists of nodes of previous window
+        communities (list): List of lists of nodes of current window
+        min_overlap (float): Ratio of both communities that shared nodes must
+            make up for the communities to be linked
+
+    Returns:
+        events (list): List of (event, previous, current) tuples
+    """
+    previous_labels = dict()
+    for i, community in enumerate(previous_communities):
+        for node in community:
+            previous_labels[node] = i
+
+    successors = [[] for _ in previous_communities]
+    predecessors = [[] for _ in communities]
+    for j, community in enumerate(communities):
+        # Count nodes shared with each previous community
+        shared_counts = dict()
+        for node in community:
+            if node in previous_labels:
+                i = previous_labels[node]
+                shared_counts[i] = shared_counts.get(i, 0) + 1
+        for i, shared in sorted(shared_counts.items()):
+            if (float(shared) / len(community) >= min_overlap and
+                    float(shared) / len(previous_communities[i]) >= min_overlap):
+                successors[i].append(j)
+                predecessors[j].append(i)
+
+    events = []
+    for i, community_successors in enumerate(successors):
+        if not community_successors:
+            events.append(('dissolve', i, None))
+        elif len(community_successors) > 1:
+            events.append(('split', i, tuple(community_successors)))
+        elif len(predecessors[community_successors[0]]) == 1:
+            events.append(('continue', i, community_successors[0]))
+    for j, community_predecessors in enumerate(predecessors):
+        if not community_predecessors:
+            events.append(('form', None, j))
+        elif len(community_predecessors) > 1:
+            events.append(('merge', tuple(community_predecessors), j))
+    return events
+
+
+def track_communities(user_user_graphs, max_passes=10, min_overlap=0.3, verbose=True):
+    """
+    Finds communities in each time window and matches them across windows.
+    Communities of the first window are found with modularity_communities, and
+    those of each later window are warm-started from the previous window.
+
+    Arguments:
+        user_user_graphs (list): List of (window, user_user_graph) pairs in
+            time order
+        max_passes (int): Maximum number of passes of warm_start_communities
+        min_overlap (float): See match_communities
+        verbose (bool): If true the events of each window are printed
+
+    Returns:
+        tracked (list): List of (window, communities, events) tuples, where
+            events match the communities to those of the previous window
+    """
+    tracked = []
+    previous_communities = None
+    for window, user_user_graph in user_user_graphs:
+        if previous_communities is None:
+            communities = list(map(list, modularity_communities(user_user_graph)))
+            events = [('form', None, j) for j in range(len(communities))]
+        else:
+            communities = warm_start_communities(user_user_graph, previous_communities, max_passes)
+            events = match_communities(previous_communities, communities, min_overlap)
+        if verbose:
+            event_counts = dict()
+            for event in events:
+                event_counts[event[0]] = event_counts.get(event[0], 0) + 1
+            print("Window {}: {} communities, {}".format(window, len(communities), event_counts))
+        tracked.append((window, communities, events))
+        previous_communities = communities
+    return tracked
+
+
+def write_tracked_communities(tracked, communities_path, events_path):
+    """
+    Writes tracked communities as window, community index and tab separated
+    nodes per line, and events as window, event, previous and current
+    community indices per line.
+
+    Arguments:
+        tracked (list): List of (window, communities, events) tuples, as
+            returned by track_communities
+        communities_path (str): Path of file to write communities to
+        events_path (str): Path of file to write events to
+    """
+    with open(communities_path, 'w') as communities_f, open(events_path, 'w') as events_f:
+        for window, communities, events in tracked:
+            for j, community in enumerate(communities):
+                communities_f.write('{}\t{}\t{}\n'.format(window, j, '\t'.join(map(str, community))))
+            for event, previous, current in events:
+                events_f.write('{}\t{}\t{}\t{}\n'.format(window, event, previous, current))
+
+
+def main(user_topic_edges_path, topic_freqs_path, communities_path, events_path,
+         window_size=3, step=1, n=20, threshold=0.35, knn=None):
+    bucket_edges = load_bucketed_edges(user_topic_edges_path)
+    topic_freqs = load_topic_frequencies(topic_freqs_path, sort_freqs=True)
+    windowed_graphs = create_windowed_user_topic_graphs(bucket_edges, window_size, step)
+    if not windowed_graphs:
+        print("No time windows: {} has no edges".format(user_topic_edges_path))
+    user_user_graphs = []
+    for window, user_topic_graph in windowed_graphs:
+        user_topic_graph = keep_top_n_topics(user_topic_graph, topic_freqs, n=n)
+        if knn:
+            user_user_graph = create_user_user_knn_graph(user_topic_graph, k=knn, verbose=False)
+        else:
+            connect_nodes_func = lambda G, u, v: connect_on_IOU(G, u, v, threshold=threshold)
+            user_user_graph = create_user_user_graph(user_topic_graph, connect_nodes_func, verbose=False)
+        user_user_graphs.append((window, user_user_graph))
+    tracked = track_communities(user_user_graphs)
+    write_tracked_communities(tracked, communities_path, events_path)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 5:
+        raise Exception("usage: python community_model.py <author_topic_monthly>.txt <topic_freq>.txt <communities>.txt <events>.txt")
+    main(*sys.argv[1:5])
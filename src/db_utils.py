@@ -1,46 +1,208 @@
+import os
 import sqlite3
 import sys
+import threading
+from urllib.parse import quote
 
 """
 Provides some utilities for querying different data from the reddit comment db.
 """
 
+class ConnectionPool():
+    def __init__(self, db_name, read_only=True, mmap_size=2**30,
+                 cache_size=-65536, cached_statements=256):
+        """
+        Pool of sqlite connections, with one connection per thread and per
+        process, so that parallel workers never share a connection. When the
+        pool is copied into another process (by fork or pickling), connections
+        of the parent are dropped and new ones are opened on first use.
+
+        Arguments:
+            db_name (str): The name of the database to connect to
+            read_only (bool): Whether connections are opened read-only. The
+                database is then switched to WAL mode so readers never block
+                each other or a writer
+            mmap_size (int): Bytes of the database to memory-map per connection
+            cache_size (int): sqlite page cache size per connection, in pages
+                if positive or in KiB if negative
+            cached_statements (int): Number of prepared statements each
+                connection keeps for reuse
+        """
+        self.db_name = db_name
+        self.read_only = read_only
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size
+        self.cached_statements = cached_statements
+        if read_only:
+            if not os.path.exists(db_name):
+                raise FileNotFoundError("Database {} does not exist".format(db_name))
+            self._enable_wal()
+        self._reset()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Connections, locks and thread locals cannot be sent to other processes
+        for attr in ('_pid', '_local', '_lock', '_connections'):
+            del state[attr]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def _uri(self, mode):
+        # Opening by URI with mode=ro or mode=rw never creates the database
+        return 'file:{}?mode={}'.format(quote(os.path.abspath(self.db_name)), mode)
+
+    def _enable_wal(self):
+        # The journal mode is stored in the database, so it has to be set once
+        # with a writable connection
+        try:
+            con = sqlite3.connect(self._uri('rw'), uri=True)
+            con.execute("PRAGMA journal_mode=WAL;")
+            con.close()
+        except sqlite3.OperationalError:
+            # Database file is not writable, readers still share a lock
+            pass
+
+    def _connect(self):
+        if self.read_only:
+            con = sqlite3.connect(self._uri('ro'), uri=True, check_same_thread=False,
+                                  cached_statements=self.cached_statements)
+        else:
+            con = sqlite3.connect(self.db_name, check_same_thread=False,
+                                  cached_statements=self.cached_statements)
+        con.execute("PRAGMA mmap_size={};".format(int(self.mmap_size)))
+        con.execute("PRAGMA cache_size={};".format(int(self.cache_size)))
+        return con
+
+    def connection(self):
+        """
+        Returns the connection of the calling thread, opening it if needed.
+
+        Returns:
+            con (sqlite3.Connection): Connection only used by this thread
+        """
+        if os.getpid() != self._pid:
+            # Forked, connections of the parent process must not be used
+            self._reset()
+        con = getattr(self._local, 'con', None)
+        if con is None:
+            con = self._connect()
+            self._local.con = con
+            with self._lock:
+                self._connections.append(con)
+        return con
+
+    def close(self):
+        """
+        Closes all connections opened by this process.
+        """
+        if os.getpid() != self._pid:
+            self._reset()
+            return
+        with self._lock:
+            for con in self._connections:
+                con.close()
+        self._reset()
+
+
 class DBWrapper():
-    def __init__(self, db_name):
+    def __init__(self, db_name, read_only=False, **pool_kwargs):
         """
         Initializes dbwrapper and creates tables that will be used.
+
+        Each thread (and process) using the dbwrapper gets its own connection
+        from a ConnectionPool, see ConnectionPool for the pool_kwargs.
         """
-        self.con = sqlite3.connect(db_name)
-        self.cur = self.con.cursor()
+        self.pool = ConnectionPool(db_name, read_only=read_only, **pool_kwargs)
         # Create necessary tables if they do not already exist
         # self.cur.execute("CREATE TABLE IF NOT EXISTS topic (word, sentiment, graph_id, freq);")
         # self.cur.execute("CREATE TABLE IF NOT EXISTS author (author_name, graph_id);")
         # self.cur.execute("CREATE TABLE IF NOT EXISTS topic_author (author_name, graph_id);")
         # self.cur.commit()
 
+    @property
+    def con(self):
+        return self.pool.connection()
+
     def __enter__(self):
         return self
 
-    def __exit__(self):
-        self.con.close()
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.pool.close()
 
-    def get_author_comments(self, author_name, limit=None):
+    def _query(self, query, params=(), limit=None):
+        # Queries are parameterized so sqlite can reuse prepared statements
+        if limit:
+            query += " LIMIT ?"
+            params = tuple(params) + (int(limit),)
+        return self.con.execute(query, params)
+
+    def get_author_comments(self, author_name, limit=None, with_time_stamps=False):
         """
         Query the comments associated with a particular author.
 
         Arguments:
             author_name (str): The auther whose comments we want to query
             limit (int): A limit on the number of comments to return
+            with_time_stamps (bool): If true, (comment, time_stamp) pairs are
+                returned instead of comments. Requires a time_stamp column
 
         Returns:
             comments (list): List of comments by the author
         """
-        query = "SELECT text FROM comments WHERE author_name LIKE \'{}\'".format(author_name)
-        if limit:
-            query += " LIMIT {}".format(limit)
-        self.cur.execute(query)
+        if with_time_stamps:
+            cur = self._query("SELECT text, time_stamp FROM comments WHERE author_name LIKE ?",
+                              (author_name,), limit)
+            return cur.fetchall()
+
+        cur = self._query("SELECT text FROM comments WHERE author_name LIKE ?",
+                          (author_name,), limit)
 
-        comments = self.cur.fetchall()
+        comments = cur.fetchall()
+        # Flatten comments into list of strings
+        comments = list(map(lambda comment: comment[0], comments))
+        return comments
+
+    def iter_author_comments(self, author_name):
+        """
+        Streams the comments associated with a particular author, without
+        loading all of them into memory.
+
+        Arguments:
+            author_name (str): The auther whose comments we want to query
+
+        Returns:
+            comments (generator): Generator of comments by the author
+        """
+        cur = self._query("SELECT text FROM comments WHERE author_name LIKE ?",
+                          (author_name,))
+        for comment in cur:
+            yield comment[0]
+
+    def sample_comments(self, n):
+        """
+        Fetches a uniformly random sample of comments, regardless of author.
+
+        Arguments:
+            n (int): Number of comments to sample
+
+        Returns:
+            comments (list): List of sampled comments
+        """
+        cur = self._query("SELECT text FROM comments ORDER BY RANDOM()", limit=n)
+
+        comments = cur.fetchall()
         # Flatten comments into list of strings
         comments = list(map(lambda comment: comment[0], comments))
         return comments
@@ -56,12 +218,9 @@ class DBWrapper():
         Returns:
             authors (list): List of unique author names
         """
-        query = "SELECT DISTINCT(author_name) FROM comments"
-        if limit:
-            query += " LIMIT {}".format(limit)
-        self.cur.execute(query)
+        cur = self._query("SELECT DISTINCT(author_name) FROM comments", limit=limit)
 
-        authors = self.cur.fetchall()
+        authors = cur.fetchall()
         # Flatten authors into list of strings
         authors = list(map(lambda author: author[0], authors))
         return authors
@@ -0,0 +1,43 @@
+import struct
+
+"""
+Header of binary edge files, shared by the writer (topic_model) and the
+loader (utils). A binary edge file starts with BINARY_EDGES_MAGIC and the
+little-endian int32 number of values per record, followed by the records.
+"""
+
+# Magic number starting binary edge files, followed by the int32 record width
+BINARY_EDGES_MAGIC = b'RCDE'
+BINARY_EDGES_HEADER_SIZE = len(BINARY_EDGES_MAGIC) + 4
+
+
+def write_binary_edges_header(out_f, record_width):
+    """
+    Writes the header of a binary edge file.
+
+    Arguments:
+        out_f (file): Binary file object to write to
+        record_width (int): Number of int32 values per edge record, 2 or 3
+            if weighted
+    """
+    out_f.write(BINARY_EDGES_MAGIC + struct.pack('<i', record_width))
+
+
+def read_binary_edges_header(edges_path):
+    """
+    Reads the header of a binary edge file.
+
+    Arguments:
+        edges_path (str): Path of the binary edge file
+
+    Returns:
+        record_width (int): Number of int32 values per edge record
+    """
+    with open(edges_path, 'rb') as edges_f:
+        header = edges_f.read(BINARY_EDGES_HEADER_SIZE)
+    if len(header) < BINARY_EDGES_HEADER_SIZE or not header.startswith(BINARY_EDGES_MAGIC):
+        raise ValueError("{} is not a binary edge file".format(edges_path))
+    record_width = struct.unpack('<i', header[len(BINARY_EDGES_MAGIC):])[0]
+    if record_width not in (2, 3):
+        raise ValueError("{} has unsupported record width {}".format(edges_path, record_width))
+    return record_width
@@ -1,6 +1,8 @@
-import networkx as nx
-import matplotlib.pyplot as plt
+import sys
 import csv
+import heapq
+import networkx as nx
+from utils import load_graph
 
 
 def load_topic_frequencies(topic_freqs_path, sort_freqs=True):
@@ -30,6 +32,72 @@ def load_topic_frequencies(topic_freqs_path, sort_freqs=True):
 
 
 
+def load_bucketed_edges(user_topic_edges_path):
+    """
+    Loads user-topic edges written per time bucket (author_id, topic_id,
+    bucket[, weight]), see topic_model.extract_topics. Edges without a weight
+    get a weight of 1.
+
+    Arguments:
+        user_topic_edges_path (str): String path of file containing bucketed
+            user-topic edges
+
+    Returns:
+        bucket_edges (dict): Map from time bucket -> list of (user, topic, weight)
+            edges
+    """
+    bucket_edges = dict()
+    with open(user_topic_edges_path) as tsv_rd:
+        rd = csv.reader(tsv_rd, delimiter="\t")
+        for row in rd:
+            bucket = row[2]
+            if bucket not in bucket_edges:
+                bucket_edges[bucket] = []
+            weight = int(row[3]) if len(row) > 3 else 1
+            bucket_edges[bucket].append((int(row[0]), int(row[1]), weight))
+    return bucket_edges
+
+
+def create_windowed_user_topic_graphs(bucket_edges, window_size=1, step=1, verbose=True):
+    """
+    Creates a user-topic graph per sliding time window. Each window covers
+    window_size consecutive time buckets (buckets without any edges are
+    skipped), and consecutive windows start step buckets apart. Edge weights
+    are summed over the buckets of a window.
+
+    Arguments:
+        bucket_edges (dict): Map from time bucket -> list of (user, topic, weight)
+            edges
+        window_size (int): Number of time buckets per window
+        step (int): Number of time buckets between the starts of two windows
+        verbose (bool): If true basic info of each graph is printed
+
+    Returns:
+        windowed_graphs (list): List of (window, user_topic_graph) pairs in
+            time order, where window is 'first_bucket:last_bucket'. Empty if
+            there are no buckets
+    """
+    buckets = sorted(bucket_edges)
+    windowed_graphs = []
+    if not buckets:
+        return windowed_graphs
+    for start in range(0, max(len(buckets) - window_size, 0) + 1, step):
+        window_buckets = buckets[start:start + window_size]
+        window = "{}:{}".format(window_buckets[0], window_buckets[-1])
+        user_topic_graph = nx.Graph()
+        for bucket in window_buckets:
+            for user, topic, weight in bucket_edges[bucket]:
+                if user_topic_graph.has_edge(user, topic):
+                    user_topic_graph[user][topic]['weight'] += weight
+                else:
+                    user_topic_graph.add_edge(user, topic, weight=weight)
+        if verbose:
+            print("Window {}: {} nodes, {} edges".format(window, user_topic_graph.number_of_nodes(),
+                                                       user_topic_graph.number_of_edges()))
+        windowed_graphs.append((window, user_topic_graph))
+    return windowed_graphs
+
+
 def keep_top_n_topics(user_topic_graph, topic_frequencies, n=20):
     """
     Removes topic nodes from the user-topic graph that are not part of the
@@ -95,6 +163,129 @@ def create_user_user_graph(user_topic_graph, connect_nodes_func, out_filename=No
     return user_user_graph
 
 
+def create_user_user_knn_graph(user_topic_graph, k=10, similarity='iou', mutual=False,
+                               weighted=False, out_filename=None, verbose=True):
+    """
+    Creates user-user graph, by connecting each user to the k users most
+    similar to it. Unlike a global similarity threshold, this keeps the
+    number of edges O(nk), however dense the topics are.
+
+    Similarities are computed one user at a time from the topics it shares with
+    other users (a row of the sparse user-user co-occurrence matrix), so only
+    users sharing at least one topic are ever considered. Weighted
+    similarities use the user-topic edge 'weight's (default 1).
+
+    Arguments:
+        user_topic_graph (nx.Graph): User-topic graph
+        k (int): Number of most similar users to connect each user to
+        similarity (str): Name of similarity in SIMILARITY_FUNCS ['iou',
+            'jaccard', 'weighted_jaccard']
+        mutual (bool): If true, users are only connected if each is among the
+            k most similar users of the other
+        weighted (bool): If true, edges have their similarity as 'weight'
+        out_filename (str): Location of where to save user-user edge list. If
+            None, graph will not be saved
+        verbose (bool): If true basic info of graph is printed
+
+    Returns:
+        user_user_graph (nx.Graph): User-user graph
+    """
+    similarity_func = SIMILARITY_FUNCS[similarity]
+    weight = 'weight' if similarity in WEIGHTED_SIMILARITIES else None
+    # User nodes are those with positive ids!
+    user_nodes = list(filter(lambda node: node > 0, user_topic_graph.nodes()))
+    degrees = dict(user_topic_graph.degree(user_nodes, weight=weight))
+
+    # Find the k most similar users of each user
+    nearest_neighbors = dict()  # Map from user -> list of (similarity, user)
+    for u in user_nodes:
+        common_counts = dict()  # Map from user -> number (or weight) of topics shared with u
+        for topic, u_data in user_topic_graph[u].items():
+            for v, v_data in user_topic_graph[topic].items():
+                if v == u:
+                    continue
+                if weight is None:
+                    common = 1
+                else:
+                    common = min(u_data.get(weight, 1), v_data.get(weight, 1))
+                common_counts[v] = common_counts.get(v, 0) + common
+        u_degree = degrees[u]
+        similarities = ((similarity_func(common, u_degree, degrees[v]), v)
+                        for v, common in common_counts.items())
+        nearest_neighbors[u] = heapq.nlargest(k, similarities)
+
+    # Create graph of user nodes
+    user_user_graph = nx.Graph()
+    user_user_graph.add_nodes_from(user_nodes)
+    if mutual:
+        nearest_sets = {u: set(map(lambda sv: sv[1], nearest_neighbors[u])) for u in user_nodes}
+    # Connect user nodes
+    for u in user_nodes:
+        for uv_similarity, v in nearest_neighbors[u]:
+            if mutual and u not in nearest_sets[v]:
+                continue
+            if weighted:
+                user_user_graph.add_edge(u, v, weight=uv_similarity)
+            else:
+                user_user_graph.add_edge(u, v)
+
+    # Save graph if necessary
+    if out_filename:
+        nx.write_edgelist(user_user_graph, out_filename)
+
+    if verbose:
+        print("Number of nodes: {}".format(nx.number_of_nodes(user_user_graph)))
+        print("Number of edges: {}".format(nx.number_of_edges(user_user_graph)))
+
+    return user_user_graph
+
+
+def iou_similarity(common_neighbors, u_neighbors, v_neighbors):
+    """
+    IOU ratio of two nodes' neighbors, as used by connect_on_IOU: the number of
+    common neighbors over the total number of neighbors of both nodes.
+
+    Arguments:
+        common_neighbors (int): Number of neighbors the nodes share
+        u_neighbors (int): Number of neighbors of the first node
+        v_neighbors (int): Number of neighbors of the second node
+
+    Returns:
+        IOU (float): IOU ratio
+    """
+    total_neighbors = u_neighbors + v_neighbors
+    if total_neighbors < 1:
+        return 0.
+    return float(common_neighbors) / total_neighbors
+
+
+def jaccard_similarity(common_neighbors, u_neighbors, v_neighbors):
+    """
+    Jaccard similarity of two nodes' neighbors: the number of common neighbors
+    over the number of distinct neighbors of both nodes.
+
+    Arguments:
+        common_neighbors (int): Number of neighbors the nodes share
+        u_neighbors (int): Number of neighbors of the first node
+        v_neighbors (int): Number of neighbors of the second node
+
+    Returns:
+        jaccard (float): Jaccard similarity
+    """
+    union_neighbors = u_neighbors + v_neighbors - common_neighbors
+    if union_neighbors < 1:
+        return 0.
+    return float(common_neighbors) / union_neighbors
+
+
+# Similarities that can be used to find nearest neighbors. Weighted
+# similarities are computed from sums of edge weights instead of counts, e.g.
+# weighted Jaccard is sum of min weights over sum of max weights
+SIMILARITY_FUNCS = {'iou': iou_similarity, 'jaccard': jaccard_similarity,
+                    'weighted_jaccard': jaccard_similarity}
+WEIGHTED_SIMILARITIES = {'weighted_jaccard'}
+
+
 def connect_on_IOU(user_topic_graph, u, v, threshold=0.35):
     """
     Dertermines whether to connect to nodes u and v based on their charactestics
@@ -116,31 +307,31 @@ def connect_on_IOU(user_topic_graph, u, v, threshold=0.35):
     # print(common_neigbhors)
     u_neighbors = len(list(user_topic_graph.neighbors(u)))
     v_neighbors = len(list(user_topic_graph.neighbors(v)))
-    total_neighbors =  u_neighbors + v_neighbors
-    # print(total_neighbors)
-    if total_neighbors < 1:
-        IOU = 0.
-    else:
-        IOU = float(common_neigbhors) / total_neighbors
+    IOU = iou_similarity(common_neigbhors, u_neighbors, v_neighbors)
 
     if IOU > threshold:
         return True
     return False
 
 
-def main():
-    user_topic_graph_path = "../data/processed/author_topic.txt"
-    topic_freqs_path = "../data/processed/topic_freq.txt"
-    user_user_graph_path = "../data/processed/user_user.txt"
-
-    user_topic_graph = load_user_topic_graph(user_topic_graph_path)
+def main(user_topic_graph_path="../data/processed/author_topic.txt",
+         topic_freqs_path="../data/processed/topic_freq.txt",
+         user_user_graph_path="../data/processed/user_user.txt",
+         n=20, threshold=0.35, knn=None, similarity='iou', mutual=False, weighted=False):
+    user_topic_graph = load_graph(user_topic_graph_path)
     topic_freqs = load_topic_frequencies(topic_freqs_path, sort_freqs=True)
     print("Total topics: {}".format(len(topic_freqs)))
-    user_topic_graph = keep_top_n_topics(user_topic_graph, topic_freqs, n=20)
-    user_user_graph = create_user_user_graph(user_topic_graph, connect_on_IOU, out_filename=user_user_graph_path)
+    user_topic_graph = keep_top_n_topics(user_topic_graph, topic_freqs, n=n)
+    if knn:
+        user_user_graph = create_user_user_knn_graph(user_topic_graph, k=knn, similarity=similarity,
+                                                     mutual=mutual, weighted=weighted,
+                                                     out_filename=user_user_graph_path)
+    else:
+        connect_nodes_func = lambda G, u, v: connect_on_IOU(G, u, v, threshold=threshold)
+        user_user_graph = create_user_user_graph(user_topic_graph, connect_nodes_func, out_filename=user_user_graph_path)
     # Report things about user-user graph
     print("User-user graph has {} nodes and {} edges".format(user_user_graph.number_of_nodes(), user_user_graph.size()))
 
 
 if __name__ == '__main__':
-    main()
+    main(*sys.argv[1:4])
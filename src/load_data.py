@@ -1,6 +1,33 @@
 import sys
 import sqlite3
 import csv
+import bz2
+import gzip
+import io
+import lzma
+import threading
+import multiprocessing
+
+# Columns of the comment dumps, in file order
+HEADERS = ["subreddit_name", "time_stamp", "subreddit_id", "comment_id",
+           "parent_comment_id", "author_name", "score", "random_id",
+           "thread_link_id", "text"]
+
+_batch_queue = None  # Queue parser worker processes put parsed batches on
+
+
+def create_table(cur, table_name, headers):
+    """
+    Creates a table with a text column per header, if it does not exist.
+
+    Arguments:
+        cur (sqlite3.Cursor): Cursor of the database to create the table in
+        table_name (str): The name of the table to be created
+        headers (list): List of header strings to use as table columns
+    """
+    table_type_columns = ", ".join(map(lambda header: header + " text", headers))  # # subreddit_name,text time_stamp text , ..., text text
+    cur.execute("CREATE TABLE IF NOT EXISTS {} ({});".format(table_name, table_type_columns))
+
 
 def create_db(tsv_filename, headers, database_name, table_name):
     """
@@ -15,8 +42,7 @@ def create_db(tsv_filename, headers, database_name, table_name):
     con = sqlite3.connect(database_name)
     cur = con.cursor()
     table_columns = ", ".join(headers)  # subreddit_name, time_stamp, ..., text
-    table_type_columns = ", ".join(map(lambda header: header + " text", headers))  # # subreddit_name,text time_stamp text , ..., text text
-    cur.execute("CREATE TABLE IF NOT EXISTS {} ({});".format(table_name, table_type_columns))
+    create_table(cur, table_name, headers)
 
     with open(tsv_filename,'r') as source_f:
         dict_reader = csv.DictReader(source_f, delimiter='\t', fieldnames=headers)
@@ -28,17 +54,218 @@ def create_db(tsv_filename, headers, database_name, table_name):
     con.close()
 
 
-def main(source_filename, database_name, table_name):
-    # headers = ["subreddit_name",  "time_stamp", "subreddit_id",  "comment_id",
-    # "parent_comment_id", "author_name", "score", "random_id", "thread_link_id", "text"]
-    headers = ["author_name", "text"]
-    create_db(source_filename, headers, database_name, table_name)
+def open_dump(filename):
+    """
+    Opens a comment dump for reading as text. The compression is determined by
+    the file extension: .bz2, .xz, .gz and .zst are supported, anything else
+    is read as an uncompressed file. Reading .zst files requires the
+    zstandard package.
+
+    Arguments:
+        filename (str): The filename of the dump
+
+    Returns:
+        dump_f (file): Text file object of the decompressed dump
+    """
+    if filename.endswith('.bz2'):
+        return bz2.open(filename, 'rt', encoding='utf-8', newline='')
+    if filename.endswith('.xz'):
+        return lzma.open(filename, 'rt', encoding='utf-8', newline='')
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rt', encoding='utf-8', newline='')
+    if filename.endswith('.zst'):
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("Reading .zst dumps requires the zstandard package")
+        # Monthly dumps are compressed with a long window, and may be made of
+        # several frames (e.g. by pzstd or when dumps are concatenated)
+        decompressor = zstandard.ZstdDecompressor(max_window_size=2**31)
+        stream = decompressor.stream_reader(open(filename, 'rb'), closefd=True,
+                                            read_across_frames=True)
+        return io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    return open(filename, 'r', encoding='utf-8', newline='')
+
+
+def _init_parser_worker(batch_queue):
+    global _batch_queue
+    _batch_queue = batch_queue
+
+
+def parse_dump(filename, column_indices, batch_size):
+    """
+    Parses a dump in a worker process and puts batches of records on the batch
+    queue. A None is always put on the queue once the file is done, so the
+    writer knows when every file has been parsed.
+
+    Arguments:
+        filename (str): The filename of the dump
+        column_indices (list): Indices (into the file's headers) of the
+            columns to keep
+        batch_size (int): Number of records per batch
+
+    Returns:
+        num_records (int): Number of records parsed from the dump
+        num_skipped (int): Number of rows skipped for having too few columns
+    """
+    num_records = 0
+    num_skipped = 0
+    min_length = max(column_indices) + 1
+    batch = []
+    try:
+        with open_dump(filename) as dump_f:
+            for row in csv.reader(dump_f, delimiter='\t'):
+                # Skip truncated rows
+                if len(row) < min_length:
+                    num_skipped += 1
+                    continue
+                batch.append(tuple([row[i] for i in column_indices]))
+                if len(batch) == batch_size:
+                    _batch_queue.put(batch)
+                    num_records += len(batch)
+                    batch = []
+        if batch:
+            _batch_queue.put(batch)
+            num_records += len(batch)
+    finally:
+        _batch_queue.put(None)
+    return num_records, num_skipped
+
+
+def write_batches(database_name, insert_query, batch_queue, num_files, errors):
+    """
+    Writes batches from the batch queue to the database until every file has
+    been parsed. Runs on a single thread, as sqlite only allows one writer. If
+    anything fails, the error is recorded and the queue is still drained so the
+    parser workers are not blocked.
+
+    Arguments:
+        database_name (str): The name of the database to connect to
+        insert_query (str): Parameterized insert statement for one record
+        batch_queue (multiprocessing.Queue): Queue of batches of records
+        num_files (int): Number of files being parsed
+        errors (list): List that any write error is appended to
+    """
+    con = None
+    remaining_files = num_files
+    try:
+        con = sqlite3.connect(database_name)
+        cur = con.cursor()
+        # Durability is not needed while bulk loading, the load can be re-run
+        cur.execute("PRAGMA journal_mode=WAL;")
+        cur.execute("PRAGMA synchronous=OFF;")
+        while remaining_files:
+            batch = batch_queue.get()
+            if batch is None:
+                remaining_files -= 1
+                continue
+            cur.executemany(insert_query, batch)
+            con.commit()
+    except Exception as e:
+        errors.append(e)
+        # Keep draining so parser workers blocked on the queue can finish
+        while remaining_files:
+            if batch_queue.get() is None:
+                remaining_files -= 1
+    finally:
+        if con is not None:
+            con.close()
+
+
+def create_db_pipelined(source_filenames, database_name, table_name,
+                        columns=None, headers=None, num_workers=None,
+                        batch_size=10000, queue_size=16, verbose=True):
+    """
+    Create a sqlite3 database from (possibly compressed) comment dumps.
+    Files are decompressed and parsed in parallel worker processes, which pass
+    batches of records over a bounded queue to a single writer thread, so
+    parsing overlaps with writing.
+
+    Arguments:
+        source_filenames (list): Filenames of the dumps, see open_dump
+        database_name (str): The name of the database to connect to
+        table_name (str): The name of the table to be created
+        columns (list): Columns (from headers) to keep. If None, all columns
+            are kept
+        headers (list): Columns the files contain, in order. If None, files
+            are full dumps with HEADERS
+        num_workers (int): Number of parser processes. If None, one per cpu
+            (but no more than the number of files)
+        batch_size (int): Number of records per batch
+        queue_size (int): Maximum number of batches waiting to be written
+        verbose (bool): If true the number of loaded records is printed
+
+    Returns:
+        num_records (int): Number of records loaded
+    """
+    if headers is None:
+        headers = HEADERS
+    if columns is None:
+        columns = headers
+    for column in columns:
+        if column not in headers:
+            raise ValueError("Unknown column '{}', expected one of {}".format(column, headers))
+    column_indices = [headers.index(column) for column in columns]
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count()
+    num_workers = max(1, min(num_workers, len(source_filenames)))
+
+    con = sqlite3.connect(database_name)
+    create_table(con.cursor(), table_name, columns)
+    con.commit()
+    con.close()
+
+    table_columns = ", ".join(columns)
+    placeholders = ", ".join(["?"] * len(columns))
+    insert_query = "INSERT INTO {} ({}) VALUES ({});".format(table_name, table_columns, placeholders)
+
+    batch_queue = multiprocessing.Queue(maxsize=queue_size)
+    errors = []
+    # Workers are forked before the writer thread starts, as forking while
+    # another thread runs can deadlock
+    pool = multiprocessing.Pool(num_workers, initializer=_init_parser_worker,
+                                initargs=(batch_queue,))
+    writer = threading.Thread(target=write_batches,
+                              args=(database_name, insert_query, batch_queue,
+                                    len(source_filenames), errors))
+    writer.start()
+    try:
+        file_counts = pool.starmap(parse_dump, [(filename, column_indices, batch_size)
+                                                for filename in source_filenames])
+    finally:
+        pool.close()
+        writer.join()
+        pool.join()
+    if errors:
+        raise errors[0]
+
+    num_records = 0
+    for filename, (records, skipped) in zip(source_filenames, file_counts):
+        num_records += records
+        if verbose or skipped:
+            print("{}: {} records, {} rows skipped for having fewer than {} columns".format(
+                filename, records, skipped, max(column_indices) + 1))
+    if verbose:
+        print("Loaded {} records into {}".format(num_records, table_name))
+    for filename, (records, skipped) in zip(source_filenames, file_counts):
+        if records == 0:
+            raise ValueError("No records loaded from {} ({} rows had too few columns), "
+                             "set headers if it does not have all of {}".format(filename, skipped, headers))
+    return num_records
+
+
+def main(source_filenames, database_name, table_name, columns=None, headers=None,
+         num_workers=None):
+    if columns is None:
+        columns = ["author_name", "time_stamp", "text"]
+        if headers is not None:
+            columns = [column for column in columns if column in headers]
+    create_db_pipelined(source_filenames, database_name, table_name,
+                        columns=columns, headers=headers, num_workers=num_workers)
 
 
 if __name__ == '__main__':
-    if len(sys.argv) != 4:
-        raise Exception("usage: python load_data.py <source>.tsv <database_name>.db <tablename>")
-    source_filename = sys.argv[1]
-    database_name = sys.argv[2]
-    table_name = sys.argv[3]
-    main(source_filename, database_name, table_name)
+    # Same arguments as 'python cli.py ingest', e.g. --headers for files
+    # that only have some of the dump columns
+    from cli import main as cli_main
+    cli_main(['ingest'] + sys.argv[1:])
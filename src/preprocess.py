@@ -6,11 +6,10 @@
 # In[1]:
 
 
+import sys
 import csv
 import re as re
 import string
-from nltk.corpus import stopwords
-import nltk.stem
 
 
 # In[ ]:
@@ -26,15 +25,35 @@ import nltk.stem
 # In[2]:
 
 
-stop_words = set(stopwords.words('english'))
-stop_words.remove("not")
-stop_words.remove("no")
+# NLTK is only loaded on first use, so importing this module is cheap
+_stop_words = None
+_stemmer = None
+
+punctuation_regex = re.compile('[%s]' % re.escape(string.punctuation))
+
+
+def get_stop_words():
+    global _stop_words
+    if _stop_words is None:
+        from nltk.corpus import stopwords
+        _stop_words = set(stopwords.words('english'))
+        _stop_words.remove("not")
+        _stop_words.remove("no")
+    return _stop_words
+
+
+def get_stemmer():
+    global _stemmer
+    if _stemmer is None:
+        import nltk.stem
+        _stemmer = nltk.stem.PorterStemmer()
+    return _stemmer
 
 
 # In[3]:
 
 
-# def preprocess(comment):   
+# def preprocess(comment):
 #     # Remove punctuation, numbers, non-alphabet characters (again), extra whitespace
 #     words = re.sub("([^\w]|[\d_])+", " ", comment).split()
 
@@ -42,8 +61,8 @@ stop_words.remove("no")
 #     # Stem with Porter's Algorithm
 #     ps = nltk.stem.PorterStemmer()
 #     filtered_sentence = [ps.stem(w) for w in words if (w not in stop_words)
-#                          and (w != 'EOS' and w != 'URL' and w!= 'SPECIAL')] 
-    
+#                          and (w != 'EOS' and w != 'URL' and w!= 'SPECIAL')]
+
 #     return " ".join(filtered_sentence)
 
 
@@ -51,43 +70,46 @@ stop_words.remove("no")
 
 
 def preprocessModified(comment):
-    
+
     # Fix contractions
     comment = comment.replace("ca n't", "cannot")
     comment = comment.replace("wo n't", "not") # will is a stop word
     comment = comment.replace("n't", "not")
     comment = comment.replace("'ve", "") # have is a stop word
-    
+
     # Remove word if it contains numbers
     comment = re.sub(r'\w*\d\w*', '', comment).strip()
-    
+
     # Remove punctuation
-    regex = re.compile('[%s]' % re.escape(string.punctuation))
-    comment = regex.sub('', comment)
-    
+    comment = punctuation_regex.sub('', comment)
+
     # Remove extra whitespace
     words = comment.split()
-    
-    ps = nltk.stem.PorterStemmer()
+
+    stop_words = get_stop_words()
+    ps = get_stemmer()
     filtered_sentence = [ps.stem(w) for w in words if (w not in stop_words)
                         and (w != 'EOS' and w != 'URL' and w!= 'SPECIAL')
-                        and (w != 'gt')] 
-    
+                        and (w != 'gt')]
+
     return " ".join(filtered_sentence)
 
 
 # In[ ]:
 
 
-# Cleans politics.tsv -> processed.tsv
+def main(source_filename="politics.tsv", output_filename="processed2.tsv"):
+    # Cleans politics.tsv -> processed.tsv
+    with open(output_filename, "w") as tsv_wr:
+        with open(source_filename) as tsv_rd:
+            wr = csv.writer(tsv_wr, delimiter="\t")
+            rd = csv.reader(tsv_rd, delimiter="\t", quotechar='"')
+            for row in rd:
+                commentId = row[3]
+                comment = row[9]
+                processed = preprocessModified(comment)
+                wr.writerow([commentId, processed])
 
-with open("processed2.tsv", "w") as tsv_wr:
-    with open("politics.tsv") as tsv_rd:
-        wr = csv.writer(tsv_wr, delimiter="\t")
-        rd = csv.reader(tsv_rd, delimiter="\t", quotechar='"')
-        for row in rd:
-            commentId = row[3]
-            comment = row[9]
-            processed = preprocessModified(comment)
-            wr.writerow([commentId, processed])
 
+if __name__ == '__main__':
+    main(*sys.argv[1:3])
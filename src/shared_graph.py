@@ -0,0 +1,368 @@
+import multiprocessing
+from collections import namedtuple
+from multiprocessing import shared_memory
+import numpy as np
+import networkx as nx
+from networkx.algorithms.community import modularity
+from analyze_graphs import modularity_communities
+
+"""
+Publish graphs once into shared memory (or a memory-mapped file) so process
+pool workers can attach to them by handle, instead of each worker receiving a
+pickled copy of the nx.Graph.
+
+A published graph is a single int64 array holding, in order:
+    node_ids (num_nodes): Node id of each node index
+    labels (num_nodes): Community index of each node, -1 if in no community
+    indptr (num_nodes + 1): Start of each node's neighbors in indices
+    indices (num_indices): Node indices of neighbors (CSR adjacency)
+"""
+
+# Picklable description of a published graph, enough for a worker to attach
+SharedGraphHandle = namedtuple('SharedGraphHandle', ['name', 'path', 'num_nodes', 'num_indices'])
+
+_attached_graphs = dict()  # Graphs attached by a pool worker, by key
+
+
+class SharedGraph():
+    def __init__(self, handle, owner, created=False):
+        """
+        Graph backed by shared memory or a memory-mapped file. Use
+        publish_graph to create one and attach_graph to attach to one.
+
+        Arguments:
+            handle (SharedGraphHandle): Description of the published graph
+            owner (SharedMemory or np.memmap): Object owning the buffer
+            created (bool): Whether this process published the graph
+        """
+        self.handle = handle
+        self._owner = owner
+        self._created = created
+        self._node_index = None
+        if isinstance(owner, np.memmap):
+            data = owner
+        else:
+            data = np.ndarray((_array_size(handle),), dtype=np.int64, buffer=owner.buf)
+        n = handle.num_nodes
+        self.node_ids = data[:n]
+        self.labels = data[n:2 * n]
+        self.indptr = data[2 * n:3 * n + 1]
+        self.indices = data[3 * n + 1:]
+
+    @property
+    def num_nodes(self):
+        return self.handle.num_nodes
+
+    @property
+    def node_index(self):
+        """
+        Map from node id -> node index, built on first use.
+        """
+        if self._node_index is None:
+            self._node_index = {node: i for i, node in enumerate(self.node_ids.tolist())}
+        return self._node_index
+
+    def neighbors(self, i):
+        """
+        Node indices of the neighbors of node index i (a view, not a copy).
+        """
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def degrees(self):
+        """
+        Degree of each node index. As in nx.Graph.degree, a self-loop adds 2
+        to the degree, though it appears once in the node's neighbors.
+        """
+        row_lengths = np.diff(self.indptr)
+        rows = np.repeat(np.arange(self.num_nodes), row_lengths)
+        self_loops = np.bincount(rows[self.indices == rows], minlength=self.num_nodes)
+        return row_lengths + self_loops
+
+    def community_members(self, label):
+        """
+        Node indices of the members of community label.
+        """
+        return np.flatnonzero(self.labels == label)
+
+    def close(self):
+        """
+        Detaches from the graph. If this process published the graph, the
+        shared memory is also freed (a memory-mapped file is left on disk).
+        """
+        self.node_ids = self.labels = self.indptr = self.indices = None
+        if isinstance(self._owner, np.memmap):
+            self._owner = None
+            return
+        self._owner.close()
+        if self._created:
+            self._owner.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _array_size(handle):
+    return 3 * handle.num_nodes + 1 + handle.num_indices
+
+
+def publish_graph(G, communities=None, path=None):
+    """
+    Publishes a graph (and optionally community labels of its nodes) into
+    shared memory, or into a memory-mapped file if a path is given. Node ids
+    must be ints. The caller should close the returned graph once workers are
+    done, which frees the shared memory.
+
+    Arguments:
+        G (nx.Graph): Graph to publish
+        communities (list): List of lists of nodes, one per community. Nodes
+            can be missing, e.g. topic nodes of a user-topic graph
+        path (str): If not None, file to memory-map the graph into
+
+    Returns:
+        shared_graph (SharedGraph): Published graph, whose handle can be
+            passed to workers
+    """
+    nodes = list(G.nodes())
+    num_nodes = len(nodes)
+    num_indices = sum(len(G[node]) for node in nodes)
+
+    if path is None:
+        size = max(8 * (3 * num_nodes + 1 + num_indices), 1)
+        owner = shared_memory.SharedMemory(create=True, size=size)
+        handle = SharedGraphHandle(owner.name, None, num_nodes, num_indices)
+    else:
+        handle = SharedGraphHandle(None, path, num_nodes, num_indices)
+        owner = np.memmap(path, dtype=np.int64, mode='w+', shape=(max(_array_size(handle), 1),))
+    shared_graph = SharedGraph(handle, owner, created=True)
+
+    index = {node: i for i, node in enumerate(nodes)}
+    shared_graph.node_ids[:] = nodes
+    shared_graph.labels[:] = -1
+    if communities is not None:
+        for label, community in enumerate(communities):
+            for node in community:
+                if node in index:
+                    shared_graph.labels[index[node]] = label
+    shared_graph.indptr[0] = 0
+    shared_graph.indptr[1:] = np.cumsum([len(G[node]) for node in nodes])
+    for i, node in enumerate(nodes):
+        shared_graph.indices[shared_graph.indptr[i]:shared_graph.indptr[i + 1]] = [index[v] for v in G[node]]
+
+    if path is not None:
+        owner.flush()
+    return shared_graph
+
+
+def attach_graph(handle):
+    """
+    Attaches to a published graph without copying it.
+
+    Arguments:
+        handle (SharedGraphHandle): Handle of the published graph
+
+    Returns:
+        shared_graph (SharedGraph): Attached graph
+    """
+    if handle.path is not None:
+        owner = np.memmap(handle.path, dtype=np.int64, mode='r', shape=(max(_array_size(handle), 1),))
+    else:
+        owner = shared_memory.SharedMemory(name=handle.name)
+    return SharedGraph(handle, owner)
+
+
+def _init_worker(handles):
+    for key, handle in handles.items():
+        _attached_graphs[key] = attach_graph(handle)
+
+
+def get_attached_graph(key):
+    """
+    Returns a graph attached by the current pool worker (see map_shared).
+
+    Arguments:
+        key (str): Key the graph's handle was given in map_shared
+
+    Returns:
+        shared_graph (SharedGraph): Attached graph
+    """
+    return _attached_graphs[key]
+
+
+def map_shared(func, handles, tasks, processes=None, chunksize=1):
+    """
+    Runs func on each task in a process pool, where each worker attaches to
+    the published graphs once when it starts. func can then get the graphs
+    with get_attached_graph. func must be defined at module level.
+
+    Arguments:
+        func (func): Function taking a task
+        handles (dict): Map from key -> SharedGraphHandle of graphs to attach
+        tasks (list): List of tasks
+        processes (int): Number of worker processes. If None, one per cpu
+        chunksize (int): Number of tasks sent to a worker at a time
+
+    Returns:
+        results (list): Result of func for each task
+    """
+    with multiprocessing.Pool(processes, initializer=_init_worker, initargs=(handles,)) as pool:
+        return pool.map(func, tasks, chunksize)
+
+
+def _prototype_task(label):
+    user_user_graph = get_attached_graph('user_user')
+    labels = user_user_graph.labels
+    max_edges = 0
+    prototype = None
+    for i in user_user_graph.community_members(label):
+        in_community_degree = np.count_nonzero(labels[user_user_graph.neighbors(i)] == label)
+        if in_community_degree > max_edges:
+            max_edges = in_community_degree
+            prototype = int(user_user_graph.node_ids[i])
+    return prototype
+
+
+def parallel_prototypes(user_user_handle, num_communities, processes=None):
+    """
+    Determines the prototype of each community (see
+    analyze_graphs.determine_prototype) in a process pool. Ties are broken
+    by node order in the graph rather than in the community.
+
+    Arguments:
+        user_user_handle (SharedGraphHandle): Handle of the user-user graph,
+            published with its communities
+        num_communities (int): Number of communities
+        processes (int): Number of worker processes
+
+    Returns:
+        prototypes (list): ID of the prototype of each community, or None
+    """
+    return map_shared(_prototype_task, {'user_user': user_user_handle},
+                      range(num_communities), processes)
+
+
+def _topic_profile_task(label):
+    user_topic_graph = get_attached_graph('user_topic')
+    members = user_topic_graph.community_members(label)
+    if len(members) == 0:
+        return []
+    topic_indices = np.concatenate([user_topic_graph.neighbors(i) for i in members])
+    topics, counts = np.unique(topic_indices, return_counts=True)
+    ratios = counts / float(len(members))
+    order = np.argsort(-ratios, kind='stable')
+    topic_ids = user_topic_graph.node_ids[topics[order]]
+    return list(zip(topic_ids.tolist(), ratios[order].tolist()))
+
+
+def parallel_topic_profiles(user_topic_handle, num_communities, processes=None):
+    """
+    Computes the ratio of members of each community linked to each topic (see
+    analyze_graphs.extract_topics_from_community) in a process pool.
+
+    Arguments:
+        user_topic_handle (SharedGraphHandle): Handle of the user-topic graph,
+            published with the communities
+        num_communities (int): Number of communities
+        processes (int): Number of worker processes
+
+    Returns:
+        topic_profiles (list): List of (topic, ratio) tuples per community, in
+            descending order of ratio
+    """
+    return map_shared(_topic_profile_task, {'user_topic': user_topic_handle},
+                      range(num_communities), processes)
+
+
+def _betweenness_task(task):
+    sources, targets = task
+    graph = get_attached_graph('user_user')
+    target_set = set(targets)
+    betweenness = np.zeros(graph.num_nodes)
+    for s in sources:
+        # Breadth-first search from s, counting shortest paths
+        S = []
+        P = dict()
+        sigma = {s: 1.}
+        D = {s: 0}
+        Q = [s]
+        for v in Q:
+            S.append(v)
+            for w in graph.neighbors(v).tolist():
+                if w not in D:
+                    Q.append(w)
+                    D[w] = D[v] + 1
+                    sigma[w] = 0.
+                    P[w] = []
+                if D[w] == D[v] + 1:
+                    sigma[w] += sigma[v]
+                    P[w].append(v)
+        # Accumulate dependencies on paths ending in targets
+        delta = dict.fromkeys(S, 0.)
+        while S:
+            w = S.pop()
+            if w in target_set and w != s:
+                coeff = (delta[w] + 1.) / sigma[w]
+            else:
+                coeff = delta[w] / sigma[w]
+            for v in P.get(w, []):
+                delta[v] += sigma[v] * coeff
+            if w != s:
+                betweenness[w] += delta[w]
+    return betweenness
+
+
+def parallel_betweenness_subset(user_user_handle, st_nodes, processes=None):
+    """
+    Computes the shortest-path betweenness centrality of each node for paths
+    between st_nodes, like the betweenness_centrality_subset used by
+    analyze_graphs.compute_betweenness_graph, with sources split across a
+    process pool.
+
+    Arguments:
+        user_user_handle (SharedGraphHandle): Handle of the user-user graph
+        st_nodes (set): Nodes to use as source and target
+        processes (int): Number of worker processes
+
+    Returns:
+        node_betweenness (dict): Dictionary of nodes with betweenness centrality as the value
+    """
+    graph = attach_graph(user_user_handle)
+    try:
+        st_indices = [graph.node_index[node] for node in st_nodes]
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        tasks = [(st_indices[i::processes], st_indices) for i in range(processes)]
+        partials = map_shared(_betweenness_task, {'user_user': user_user_handle}, tasks, processes)
+        # Undirected paths are counted from both ends
+        betweenness = np.sum(partials, axis=0) * 0.5
+        return dict(zip(graph.node_ids.tolist(), betweenness.tolist()))
+    finally:
+        graph.close()
+
+
+def _configuration_model_task(seed):
+    graph = get_attached_graph('user_user')
+    config = nx.configuration_model(graph.degrees().tolist(), seed=seed)
+    communities = modularity_communities(config)
+    return len(communities), modularity(config, communities)
+
+
+def parallel_configuration_model_communities(user_user_handle, num_samples, processes=None, seed=224):
+    """
+    Samples configuration model graphs with the same degree sequence as the
+    user-user graph (see analyze_graphs.configuration_model) in a process
+    pool, and finds modularity-maximizing communities of each.
+
+    Arguments:
+        user_user_handle (SharedGraphHandle): Handle of the user-user graph
+        num_samples (int): Number of configuration model graphs to sample
+        processes (int): Number of worker processes
+        seed (int): Seed of the first sample, following samples use seed + i
+
+    Returns:
+        samples (list): List of (number of communities, modularity) per sample
+    """
+    return map_shared(_configuration_model_task, {'user_user': user_user_handle},
+                      [seed + i for i in range(num_samples)], processes)
@@ -1,17 +1,108 @@
 import sys
-import random
-import numpy as np
-import sqlite3
+import time
+from array import array
+from datetime import datetime, timezone
 from db_utils import DBWrapper
-import nltk
-from nltk import word_tokenize
-nltk.download('averaged_perceptron_tagger')
-from nltk import pos_tag
-nltk.download('vader_lexicon')
-from nltk.sentiment.vader import SentimentIntensityAnalyzer as SIA
+from edge_format import write_binary_edges_header
+
+"""
+NLTK and its models are only loaded on first use, so importing this module is
+cheap and does no I/O. Models are looked up offline; they are never downloaded.
+"""
+
+_tokenizer = None  # Cached nltk word tokenizer
+_tagger = None  # Cached nltk perceptron pos tagger
+
+# Tokens that end a sentence, used to bound the context handed to the tagger
+SENTENCE_BOUNDARIES = {'.', '!', '?', 'EOS'}
+
+
+class AuthorTopicEdgeWriter():
+    def __init__(self, output_name, binary=False, weighted=False, bucketed=False):
+        """
+        Writes author -> topic edges one author at a time. Topics of the
+        current author are deduplicated (and counted) until the author is
+        flushed, so memory is bounded by one author's topics rather than
+        growing with every edge written.
+
+        Text output has one author_graph_id, topic_graph_id[, time bucket]
+        [, weight] edge per line. Binary output is a sequence of little-endian
+        int32 (author_graph_id, topic_graph_id[, weight]) records, after a
+        header (see edge_format). It does not support time buckets.
+
+        Arguments:
+            output_name (str): Filename of where to write edges
+            binary (bool): Whether to write binary instead of text output
+            weighted (bool): Whether to write the number of the author's
+                comments mentioning the topic as edge weight
+            bucketed (bool): Whether edges are added per time bucket
+        """
+        if binary and bucketed:
+            raise ValueError("Binary edge output does not support time buckets, "
+                             "write edges to a text file instead")
+        self.binary = binary
+        self.weighted = weighted
+        self.bucketed = bucketed
+        self._out_f = open(output_name, 'wb' if binary else 'w')
+        if binary:
+            write_binary_edges_header(self._out_f, 3 if weighted else 2)
+        self._author_topics = dict()  # Map from (topic_graph_id, bucket) -> num comments
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, topic_id, bucket=None):
+        """
+        Links the current author to a topic, once per comment mentioning it.
+
+        Arguments:
+            topic_id (int): Graph id of the topic
+            bucket (str): Time bucket of the comment, if edges are per bucket
+        """
+        if (bucket is not None) != self.bucketed:
+            raise ValueError("Edges must have a time bucket if and only if the writer is bucketed")
+        key = (topic_id, bucket)
+        self._author_topics[key] = self._author_topics.get(key, 0) + 1
+
+    def flush(self, author_id):
+        """
+        Writes the edges of the current author and starts the next author.
+
+        Arguments:
+            author_id (int): Graph id of the current author
+        """
+        if self.binary:
+            records = array('i')
+            for (topic_id, _), weight in self._author_topics.items():
+                records.append(author_id)
+                records.append(topic_id)
+                if self.weighted:
+                    records.append(weight)
+            if sys.byteorder == 'big':
+                records.byteswap()
+            self._out_f.write(records.tobytes())
+        else:
+            lines = []
+            for (topic_id, bucket), weight in self._author_topics.items():
+                edge = [author_id, topic_id]
+                if bucket is not None:
+                    edge.append(bucket)
+                if self.weighted:
+                    edge.append(weight)
+                lines.append('\t'.join(map(str, edge)) + '\n')
+            self._out_f.write(''.join(lines))
+        self._author_topics = dict()
+
+    def close(self):
+        self._out_f.close()
+
 
 def extract_topics(dbw, author_output, topic_output,
-                   topic_freq_output, author_topic_output):
+                   topic_freq_output, author_topic_output, pos_lexicon=None,
+                   time_bucket_func=None, weighted_edges=False):
     """
     For each author, the comments written by that author are analyzed in two
     ways to extract topics. First, the sentiment of the overall comment is
@@ -25,6 +116,8 @@ def extract_topics(dbw, author_output, topic_output,
 
     While processing each comment for each author, and extrating topics, the
     frequency of each topic is kept. The author is also 'linked' to the topics.
+    If a time_bucket_func is given, links are made per time bucket (e.g. per
+    month) of the comments, so graphs can be built per time window.
 
     Arguments:
         dbw (DBWrapper): Databaser wrapper object linked to the databse that
@@ -36,16 +129,23 @@ def extract_topics(dbw, author_output, topic_output,
         topic_freq_output (str): Filename of where to write topic_graph_id ->
             topic frequency
         author_topic_output (str): Filename of where to write author_graph_id
-            -> topic_graph_id edges
+            -> topic_graph_id edges. Edges are written in binary if the
+            filename ends with '.bin' (see AuthorTopicEdgeWriter)
+        pos_lexicon (dict): If not None, lexicon (see build_pos_lexicon) used
+            to tag unambiguous words by lookup instead of the full pos tagger
+        time_bucket_func (func): If not None, function mapping a comment's
+            time_stamp to its time bucket (see month_bucket). Edges are then
+            written as author_graph_id -> topic_graph_id -> time bucket
+        weighted_edges (bool): Whether edges are weighted by the number of the
+            author's comments mentioning the topic
     """
     # Trackers:
     author_to_id_map = dict()  # Map from author_name -> author_graph_id
     topic_to_id_map = dict()  # Map from (word, sentiment) -> topic_graph_id
     topic_id_to_frequency_map = dict()  # Map from topic_graph_id -> frequency
-    author_topic_pairs = set()  # Set of (author_graph_id, topic_graph_id) pairs
 
     # Instantiate SIA object
-    sid = SIA()
+    sid = load_sentiment_analyzer()
     # Get unique list of authors from dbw
     # Load top authors
     top_authors = []
@@ -61,9 +161,12 @@ def extract_topics(dbw, author_output, topic_output,
     author_graph_id = 1
     topic_graph_id = -1
 
-    with open(author_topic_output, 'w') as author_topic_f:
+    binary_edges = author_topic_output.endswith('.bin')
+    with AuthorTopicEdgeWriter(author_topic_output, binary_edges, weighted_edges,
+                               bucketed=time_bucket_func is not None) as edge_writer:
         for i, author in enumerate(authors):
-            author_comments = dbw.get_author_comments(author)
+            author_comments = dbw.get_author_comments(author,
+                with_time_stamps=time_bucket_func is not None)
 
             if i % 100 == 0:
                 print("On author {}: {} - {}".format(i, author, len(author_comments)))
@@ -72,10 +175,14 @@ def extract_topics(dbw, author_output, topic_output,
             author_to_id_map[author] = author_graph_id
             # TODO Maybe add author to db table?
             for comment in author_comments:
+                bucket = None
+                if time_bucket_func is not None:
+                    comment, time_stamp = comment
+                    bucket = time_bucket_func(time_stamp)
                 # Extract sentiment
                 sentiment = vader_sentiment_extractor(comment, sid)
                 # Extract NOUN topics
-                topics = pos_topic_extractor(comment)
+                topics = pos_topic_extractor(comment, pos_lexicon)
 
                 for topic in topics:
                     # Record (topic, sentiment) and topic_graph_id
@@ -89,13 +196,11 @@ def extract_topics(dbw, author_output, topic_output,
                     topic_id_to_frequency_map[topic_to_id_map[(topic, sentiment)]] += 1
                     # TODO Maybe add topic to db table?
 
-                    # Make note of author -> topic link by writing edge in file
-                    author_id = author_to_id_map[author]
-                    topic_id = topic_to_id_map[(topic, sentiment)]
-                    if (author_id, topic_id) not in author_topic_pairs:
-                        author_topic_f.write('{}\t{}\n'.format(author_id, topic_id))
-                        author_topic_pairs.add((author_id, topic_id))
+                    # Make note of author -> topic link, written once author is done
+                    edge_writer.add(topic_to_id_map[(topic, sentiment)], bucket)
 
+            # Write author's edges to file
+            edge_writer.flush(author_to_id_map[author])
             # Increment author graph id
             author_graph_id += 1
 
@@ -105,6 +210,23 @@ def extract_topics(dbw, author_output, topic_output,
         write_mappings(topic_id_to_frequency_map, topic_freq_output)
 
 
+def month_bucket(time_stamp):
+    """
+    Time bucket of a comment by month. Time stamps may be unix epoch seconds or
+    start with an ISO date ('YYYY-MM-DD ...').
+
+    Arguments:
+        time_stamp (str): Time stamp of the comment
+
+    Returns:
+        bucket (str): Month of the comment, as 'YYYY-MM'
+    """
+    try:
+        return datetime.fromtimestamp(float(time_stamp), timezone.utc).strftime('%Y-%m')
+    except ValueError:
+        return time_stamp[:7]
+
+
 def vader_sentiment_extractor(comment, sid):
     """
     Get sentiment of a comment using nltk's vader SentimentIntensityAnalyzer.
@@ -123,19 +245,27 @@ def vader_sentiment_extractor(comment, sid):
         sentiment = '-'
     return sentiment
 
-def pos_topic_extractor(comment):
+def pos_topic_extractor(comment, lexicon=None):
     """
     Get nouns from a comment, where nouns are determined by nltk's pos tagger.
     Nouns with fewer than 2 charaters are ignored.
 
+    If a lexicon is given, words it resolves are tagged by lookup and the pos
+    tagger is only run on sentences that still contain ambiguous words.
+
     Arguments:
         comment (str): Comment to be analyzed
+        lexicon (dict): Mapping from word -> tag of unambiguous words (see
+            build_pos_lexicon). If None, every word is tagged by the pos tagger
 
     Returns:
         nouns (set): Set of nouns extracted from comment
     """
     words = word_tokenize(comment)
-    pos_tags = pos_tag(words)
+    if lexicon is None:
+        pos_tags = pos_tag(words)
+    else:
+        pos_tags = lexicon_pos_tag(words, lexicon)
 
     # Filter out words that are not NOUNs and have fewer than 2 characters
     noun_tuples = list(filter(lambda pos_tag: pos_tag[1] == 'NN' and len(pos_tag[0]) > 2, pos_tags))
@@ -143,6 +273,229 @@ def pos_topic_extractor(comment):
     return nouns
 
 
+def require_nltk_resource(resource_path, package):
+    """
+    Checks that an nltk resource is installed, without downloading it.
+
+    Arguments:
+        resource_path (str): Path of the resource within nltk_data
+        package (str): Name of the nltk package providing the resource
+    """
+    import nltk
+    try:
+        nltk.data.find(resource_path)
+    except LookupError:
+        raise LookupError("NLTK resource '{}' is not installed. Install it "
+                          "with: python -m nltk.downloader {}".format(package, package))
+
+
+def load_sentiment_analyzer():
+    """
+    Loads nltk's vader SentimentIntensityAnalyzer.
+
+    Returns:
+        sid (SentimentIntensityAnalyzer): Vader sentiment analyzer
+    """
+    require_nltk_resource('sentiment/vader_lexicon.zip', 'vader_lexicon')
+    from nltk.sentiment.vader import SentimentIntensityAnalyzer
+    return SentimentIntensityAnalyzer()
+
+
+def word_tokenize(comment):
+    """
+    Tokenizes a comment with nltk's word tokenizer, loading it on first use.
+
+    Arguments:
+        comment (str): Comment to be tokenized
+
+    Returns:
+        words (list): List of tokens
+    """
+    global _tokenizer
+    if _tokenizer is None:
+        require_nltk_resource('tokenizers/punkt', 'punkt')
+        from nltk import word_tokenize as nltk_word_tokenize
+        _tokenizer = nltk_word_tokenize
+    return _tokenizer(comment)
+
+
+def pos_tag(words):
+    """
+    Tags words with nltk's averaged perceptron tagger. The tagger is loaded
+    once and reused, rather than reloaded on every call as nltk.pos_tag does.
+
+    Arguments:
+        words (list): List of tokens
+
+    Returns:
+        pos_tags (list): List of (word, tag) pairs
+    """
+    global _tagger
+    if _tagger is None:
+        require_nltk_resource('taggers/averaged_perceptron_tagger', 'averaged_perceptron_tagger')
+        from nltk.tag.perceptron import PerceptronTagger
+        _tagger = PerceptronTagger()
+    return _tagger.tag(words)
+
+
+def lexicon_pos_tag(words, lexicon, stats=None):
+    """
+    Tags words by looking them up in the lexicon. Sentences that contain a word
+    the lexicon cannot resolve are tagged in full by nltk's pos tagger, so the
+    ambiguous word still gets its context. Words with 2 or fewer characters are
+    never topics, so they do not trigger the tagger and may be left untagged.
+
+    Arguments:
+        words (list): Tokenized comment
+        lexicon (dict): Mapping from word -> tag of unambiguous words
+        stats (dict): If not None, counts of 'sentences', 'tokens',
+            'tagged_sentences' and 'tagged_tokens' (those handed to the pos
+            tagger) are added to it
+
+    Returns:
+        pos_tags (list): List of (word, tag) pairs, where tag is None for short
+            words that could not be resolved
+    """
+    pos_tags = []
+    sentence_start = 0
+    ambiguous = False
+    last = len(words) - 1
+    for i, word in enumerate(words):
+        tag = lexicon.get(word)
+        if tag is None and len(word) > 2:
+            ambiguous = True
+        pos_tags.append((word, tag))
+
+        # Fall back to the pos tagger for the whole sentence if needed
+        if word in SENTENCE_BOUNDARIES or i == last:
+            if ambiguous:
+                pos_tags[sentence_start:i + 1] = pos_tag(words[sentence_start:i + 1])
+            if stats is not None:
+                stats['sentences'] = stats.get('sentences', 0) + 1
+                stats['tokens'] = stats.get('tokens', 0) + i + 1 - sentence_start
+                if ambiguous:
+                    stats['tagged_sentences'] = stats.get('tagged_sentences', 0) + 1
+                    stats['tagged_tokens'] = stats.get('tagged_tokens', 0) + i + 1 - sentence_start
+            sentence_start = i + 1
+            ambiguous = False
+
+    return pos_tags
+
+
+def build_tag_distributions(comments):
+    """
+    Tags a sample of comments with nltk's pos tagger and counts how often each
+    word is given each tag.
+
+    Arguments:
+        comments (list): List of comments to be tagged
+
+    Returns:
+        tag_distributions (dict): Mapping from word -> (tag -> count)
+    """
+    tag_distributions = dict()
+    for comment in comments:
+        for word, tag in pos_tag(word_tokenize(comment)):
+            if word not in tag_distributions:
+                tag_distributions[word] = dict()
+            word_tags = tag_distributions[word]
+            word_tags[tag] = word_tags.get(tag, 0) + 1
+    return tag_distributions
+
+
+def build_pos_lexicon(tag_distributions, min_count=5, min_purity=0.99):
+    """
+    Builds a lexicon of words whose tag can be determined without context.
+    Since only 'NN' tags are used as topics, a word is unambiguous when it is
+    (almost) always tagged 'NN' or (almost) never tagged 'NN', even if its
+    other tags vary.
+
+    Arguments:
+        tag_distributions (dict): Mapping from word -> (tag -> count), as
+            returned by build_tag_distributions
+        min_count (int): Number of times a word must be seen to be included
+        min_purity (float): Ratio of the word's tags that must agree on
+            'NN' / not 'NN' for the word to be included
+
+    Returns:
+        lexicon (dict): Mapping from word -> tag of unambiguous words
+    """
+    lexicon = dict()
+    for word, tag_counts in tag_distributions.items():
+        total = sum(tag_counts.values())
+        if total < min_count:
+            continue
+        noun_ratio = float(tag_counts.get('NN', 0)) / total
+        if noun_ratio >= min_purity:
+            lexicon[word] = 'NN'
+        elif noun_ratio <= 1. - min_purity:
+            # Keep the most common tag, which is known not to be 'NN'
+            lexicon[word] = max(tag_counts, key=tag_counts.get)
+    return lexicon
+
+
+def measure_tagger_agreement(comments, lexicon, verbose=True):
+    """
+    Compares the nouns found using the lexicon against those found by the full
+    pos tagger, and how much faster noun extraction is with the lexicon.
+
+    Arguments:
+        comments (list): List of comments to compare on (ideally not the ones
+            the lexicon was built from)
+        lexicon (dict): Mapping from word -> tag of unambiguous words
+        verbose (bool): If true the agreement is printed
+
+    Returns:
+        token_agreement (float): Ratio of candidate words (more than 2
+            characters) whose noun / not noun decision agrees
+        comment_agreement (float): Ratio of comments with identical noun sets
+        skipped_sentence_ratio (float): Ratio of sentences tagged by lookup
+            only, without running the pos tagger
+        skipped_token_ratio (float): Ratio of tokens in those sentences
+        speedup (float): Time of noun extraction with the pos tagger over
+            time with the lexicon
+    """
+    num_tokens = 0
+    agreeing_tokens = 0
+    agreeing_comments = 0
+    stats = dict()
+    for comment in comments:
+        words = word_tokenize(comment)
+        full_tags = pos_tag(words)
+        fast_tags = lexicon_pos_tag(words, lexicon, stats)
+        for (word, full_tag), (_, fast_tag) in zip(full_tags, fast_tags):
+            if len(word) <= 2:
+                continue
+            num_tokens += 1
+            agreeing_tokens += (full_tag == 'NN') == (fast_tag == 'NN')
+        if pos_topic_extractor(comment) == pos_topic_extractor(comment, lexicon):
+            agreeing_comments += 1
+
+    # Time both ways of extracting nouns (tokenizer and tagger are loaded above)
+    start = time.perf_counter()
+    for comment in comments:
+        pos_topic_extractor(comment)
+    full_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for comment in comments:
+        pos_topic_extractor(comment, lexicon)
+    fast_time = time.perf_counter() - start
+
+    token_agreement = float(agreeing_tokens) / max(num_tokens, 1)
+    comment_agreement = float(agreeing_comments) / max(len(comments), 1)
+    skipped_sentence_ratio = 1. - float(stats.get('tagged_sentences', 0)) / max(stats.get('sentences', 0), 1)
+    skipped_token_ratio = 1. - float(stats.get('tagged_tokens', 0)) / max(stats.get('tokens', 0), 1)
+    speedup = full_time / max(fast_time, 1e-9)
+    if verbose:
+        print("Lexicon size: {}".format(len(lexicon)))
+        print("Sentences not needing pos tagger: {:.4f}".format(skipped_sentence_ratio))
+        print("Tokens not needing pos tagger: {:.4f}".format(skipped_token_ratio))
+        print("Noun agreement with pos tagger: {:.4f}".format(token_agreement))
+        print("Comments with identical nouns: {:.4f}".format(comment_agreement))
+        print("Noun extraction speedup: {:.2f}x".format(speedup))
+    return token_agreement, comment_agreement, skipped_sentence_ratio, skipped_token_ratio, speedup
+
+
 def write_mappings(mapping, output_name):
     with open(output_name, 'w') as out_f:
         for key in mapping:
@@ -150,10 +503,24 @@ def write_mappings(mapping, output_name):
 
 
 def main(db_name, author_output, topic_output,
-    topic_freq_output, author_topic_output):
-    dbw = DBWrapper(db_name)
-    extract_topics(dbw, author_output, topic_output,
-        topic_freq_output, author_topic_output)
+    topic_freq_output, author_topic_output, lexicon_sample=None, monthly=False,
+    weighted_edges=False):
+    if monthly and author_topic_output.endswith('.bin'):
+        # Checked before the lexicon is built, see AuthorTopicEdgeWriter
+        raise ValueError("Binary edge output does not support time buckets, "
+                         "write monthly edges to a text file instead")
+    with DBWrapper(db_name, read_only=True) as dbw:
+        pos_lexicon = None
+        if lexicon_sample:
+            # Build lexicon from one half of the sample and check it on the other
+            sample = dbw.sample_comments(lexicon_sample)
+            split = len(sample) // 2
+            pos_lexicon = build_pos_lexicon(build_tag_distributions(sample[:split]))
+            measure_tagger_agreement(sample[split:], pos_lexicon)
+        time_bucket_func = month_bucket if monthly else None
+        extract_topics(dbw, author_output, topic_output,
+            topic_freq_output, author_topic_output, pos_lexicon, time_bucket_func,
+            weighted_edges)
 
 if __name__ == '__main__':
     db_name = sys.argv[1]
@@ -161,6 +528,7 @@ if __name__ == '__main__':
     topic_output = sys.argv[3]
     topic_freq_output = sys.argv[4]
     author_topic_output = sys.argv[5]
+    lexicon_sample = int(sys.argv[6]) if len(sys.argv) > 6 else None
 
     main(db_name, author_output, topic_output,
-         topic_freq_output, author_topic_output)
+         topic_freq_output, author_topic_output, lexicon_sample)
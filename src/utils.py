@@ -1,8 +1,12 @@
 import networkx as nx
-import matplotlib.pyplot as plt
 import numpy as np
+from edge_format import BINARY_EDGES_HEADER_SIZE, read_binary_edges_header
+
 
 def plot_graph(G, communities=None):
+    # matplotlib is slow to import, so only load it when plotting
+    import matplotlib.pyplot as plt
+
     if communities is None:
         communities = [G.nodes()]
     num_communities = len(communities)
@@ -17,7 +21,11 @@ def plot_graph(G, communities=None):
 
 def load_graph(G_path, verbose=True):
     """
-    Loads graph from saved edge list
+    Loads graph from saved edge list. Edge lists ending with '.bin' are read
+    as binary int32 records (see topic_model.AuthorTopicEdgeWriter). Whether
+    edges have a weight is read from the binary header, or for text edge lists
+    from whether the first line has an int weight as third column. Edge lists
+    per time bucket are not graphs, see graph_model.load_bucketed_edges.
 
     Arguments:
         G_path (str): String path of file containing user-topic edge list
@@ -26,13 +34,42 @@ def load_graph(G_path, verbose=True):
     Returns:
         G (nx.Graph): User-topic graph
     """
-    G = nx.read_edgelist(G_path, nodetype=int)
+    if G_path.endswith('.bin'):
+        record_width = read_binary_edges_header(G_path)
+        edges = np.fromfile(G_path, dtype='<i4', offset=BINARY_EDGES_HEADER_SIZE).reshape(-1, record_width)
+        G = nx.Graph()
+        if record_width == 3:
+            G.add_weighted_edges_from(edges.tolist())
+        else:
+            G.add_edges_from(edges.tolist())
+    elif _has_int_weights(G_path):
+        G = nx.read_edgelist(G_path, nodetype=int, data=(('weight', int),))
+    else:
+        G = nx.read_edgelist(G_path, nodetype=int)
     if verbose:
         print("Number of nodes: {}".format(nx.number_of_nodes(G)))
         print("Number of edges: {}".format(nx.number_of_edges(G)))
     return G
 
 
+def _has_int_weights(G_path):
+    # Weighted edges from topic_model have a plain int third column, while
+    # nx.write_edgelist writes edge data as a dict ('1 2 {}')
+    with open(G_path, 'r') as edges_f:
+        for line in edges_f:
+            columns = line.split()
+            if not columns:
+                continue
+            if len(columns) == 2 or columns[2].startswith('{'):
+                return False
+            if len(columns) == 3 and columns[2].lstrip('-').isdigit():
+                return True
+            raise ValueError("{} is not an edge list: '{}' is not an int weight. Edges per "
+                             "time bucket (extract --monthly) are loaded with "
+                             "graph_model.load_bucketed_edges".format(G_path, columns[2]))
+    return False
+
+
 def save_graph(G, G_path):
     """
     Save graph to path
@@ -41,6 +78,36 @@ def save_graph(G, G_path):
 
 
 
+def save_communities(communities, communities_path):
+    """
+    Saves communities, one community per line as tab separated node ids
+
+    Arguments:
+        communities (list): List of lists of nodes, one per community
+        communities_path (str): Path of file to write communities to
+    """
+    with open(communities_path, 'w') as out_f:
+        for community in communities:
+            out_f.write('\t'.join(map(str, community)) + '\n')
+
+
+def load_communities(communities_path):
+    """
+    Loads communities saved with save_communities
+
+    Arguments:
+        communities_path (str): Path of file containing communities
+
+    Returns:
+        communities (list): List of lists of nodes, one per community
+    """
+    communities = []
+    with open(communities_path, 'r') as communities_f:
+        for line in communities_f:
+            communities.append(list(map(int, line.split())))
+    return communities
+
+
 def get_literal_topics(topic_nodes, topic_map):
     """
     Given list of topic node ids, returns actual topic strings